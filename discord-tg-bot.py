@@ -1,10 +1,10 @@
 import asyncio
-import json
 import logging
 import os
+import pickle
 import time
 import sys
-from typing import Set, Dict, Any
+from typing import Set, Dict, Any, Optional
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from pathlib import Path
@@ -12,11 +12,28 @@ from pathlib import Path
 import discord
 from discord.ext import commands
 from discord.ui import View, Button
+import aiofiles
 import aiohttp
+import orjson
+from aiolimiter import AsyncLimiter
 from dotenv import load_dotenv
 
+try:
+    from telethon import TelegramClient
+    from telethon.sessions import StringSession
+except ImportError:  # ✅ telethon опционален: без него рассылка идёт через Bot API
+    TelegramClient = None
+    StringSession = None
+
 storage = None
 notifier_obj = None
+_clock_hm = time.strftime("%H:%M")  # ✅ Текущее время "ЧЧ:ММ", обновляется задачей _tick
+
+
+class LazyStrMap(dict):
+    """Словарь для str.format_map: неизвестный плейсхолдер → пустая строка"""
+    def __missing__(self, key):
+        return ""
 
 
 # Встроенный MessageFormatter
@@ -30,11 +47,18 @@ class MessageFormatter:
         formatted = MessageFormatter._replace_placeholders(text, kwargs)
         return formatted[:4096] if len(formatted) > 4096 else formatted
     
+    @staticmethod
+    def format_safe(text: str, **kwargs) -> str:
+        """Без проверки длины - только для коротких шаблонов (voice_events, subscription),
+        которые с подстановками гарантированно меньше 4096 символов"""
+        return MessageFormatter._replace_placeholders(text, kwargs)
+    
     @staticmethod
     def _replace_placeholders(text: str, replacements: Dict[str, Any]) -> str:
+        # ✅ format_map без копирования kwargs и str() - "{x}" и так форматирует через str
         try:
-            return text.format(**{k: str(v) for k, v in replacements.items()})
-        except KeyError:
+            return text.format_map(LazyStrMap(replacements))
+        except (KeyError, IndexError, ValueError, AttributeError, TypeError):
             return text
 
 
@@ -44,9 +68,15 @@ load_dotenv()
 # Константы
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 TG_TOKEN = os.getenv("TG_TOKEN")
+TG_API_BASE_URL = os.getenv("TG_API_BASE_URL", "https://api.telegram.org")  # ✅ Локальный telegram-bot-api сервер
+TG_API_ID = os.getenv("TG_API_ID")
+TG_API_HASH = os.getenv("TG_API_HASH")
+TG_SESSION = os.getenv("TG_SESSION", "")
+TG_SESSION_FILE = os.getenv("TG_SESSION_FILE", "mtproto_bot")  # ✅ Файл сессии Telethon, если TG_SESSION не задан
 CHAT_FILE = "chat_ids.json"
 SUBS_FILE = "subscribers.json"
 MESSAGES_FILE = "messages.json"
+TG_RATE_LIMIT = 30  # ✅ Лимит Telegram: сообщений в секунду на бота
 
 # Логирование
 logging.basicConfig(
@@ -59,6 +89,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Голосовые события: (ключ шаблона, условие по (before.channel, after.channel))
+VOICE_EVENTS = (
+    ("joined", lambda before, after: after is not None and before is None),  # 🟢 Вход
+    ("left", lambda before, after: before is not None and after is None),  # 🔴 Выход
+    ("moved", lambda before, after: before is not None and after is not None and before != after),  # 🔄 Перемещение
+)
+
 
 @dataclass
 class BotConfig:
@@ -80,10 +117,12 @@ class AtomicFileHandler:
     _locks = {}
     
     @classmethod
-    async def _get_lock(cls, filename):
-        if filename not in cls._locks:
-            cls._locks[filename] = asyncio.Lock()
-        return cls._locks[filename]
+    def _get_lock(cls, filename):
+        # ✅ Синхронно: между проверкой и созданием нет await, второй Lock появиться не может
+        lock = cls._locks.get(filename)
+        if lock is None:
+            lock = cls._locks[filename] = asyncio.Lock()
+        return lock
     
     @staticmethod
     async def load(filename, default_factory=set):
@@ -91,55 +130,88 @@ class AtomicFileHandler:
         if not path.exists():
             return default_factory()
         
-        lock = await AtomicFileHandler._get_lock(filename)
-        async with lock:
-            try:
-                with open(filename, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                if isinstance(data, list):
-                    return set(data)
-                elif isinstance(data, dict) and 'data' in data:
-                    return set(data['data'])
-                return default_factory()
-            except:
-                return default_factory()
+        # ✅ Блокировка не нужна: save подменяет файл атомарно через replace
+        try:
+            async with aiofiles.open(filename, 'rb') as f:
+                data = orjson.loads(await f.read())
+            if isinstance(data, list):
+                return set(data)
+            elif isinstance(data, dict) and 'data' in data:
+                return set(data['data'])
+            return default_factory()
+        except Exception:
+            return default_factory()
     
     @staticmethod
     async def save(filename, data):
         path = Path(filename)
-        lock = await AtomicFileHandler._get_lock(filename)
+        payload = orjson.dumps({'data': list(data)}, option=orjson.OPT_INDENT_2)  # ✅ Снимок до первого await
+        lock = AtomicFileHandler._get_lock(filename)
         async with lock:
             try:
                 temp = path.with_suffix('.tmp')
-                with open(temp, 'w', encoding='utf-8') as f:
-                    json.dump({'data': list(data)}, f, indent=2, ensure_ascii=False)
+                async with aiofiles.open(temp, 'wb') as f:
+                    await f.write(payload)
+                    await f.flush()
+                    await asyncio.to_thread(os.fsync, f.fileno())
                 temp.replace(path)
                 return True
-            except:
+            except Exception:
                 return False
 
 
 class DataStorage:
+    FLUSH_INTERVAL = 3  # ✅ Период сброса изменений на диск (сек)
+    
     def __init__(self):
         self.chat_ids: Set[str] = set()
         self.subscribers: Set[int] = set()
         self.bot_start_time = time.time()  # ✅ Время запуска
+        self._dirty: Set[str] = set()  # ✅ Изменённые в памяти, но ещё не сохранённые данные
+        self._status_cache_text: Optional[str] = None  # ✅ Готовый список подписчиков для /status
     
     async def load_all(self):
         self.chat_ids = await AtomicFileHandler.load(CHAT_FILE)
         self.subscribers = await AtomicFileHandler.load(SUBS_FILE)
         logger.info(f"Загружено {len(self.chat_ids)} чатов, {len(self.subscribers)} подписчиков")
     
-    async def save_chat_ids(self):
-        return await AtomicFileHandler.save(CHAT_FILE, self.chat_ids)
+    def save_chat_ids(self):
+        self._dirty.add("chats")
+    
+    def save_subscribers(self):
+        self._dirty.add("subs")
+    
+    async def flush(self):
+        """Сохраняет на диск только изменённые наборы"""
+        files = {"chats": (CHAT_FILE, self.chat_ids), "subs": (SUBS_FILE, self.subscribers)}
+        dirty, self._dirty = self._dirty, set()
+        try:
+            for key in dirty:
+                filename, data = files[key]
+                if not await AtomicFileHandler.save(filename, data):
+                    logger.error(f"Ошибка сохранения {filename}")
+                    self._dirty.add(key)
+        except asyncio.CancelledError:
+            self._dirty |= dirty  # ✅ Отмена посреди сохранения - досохранит финальный flush
+            raise
     
-    async def save_subscribers(self):
-        return await AtomicFileHandler.save(SUBS_FILE, self.subscribers)
+    async def _flusher(self):
+        """Периодический сброс изменений на диск"""
+        while True:
+            try:
+                await asyncio.sleep(self.FLUSH_INTERVAL)
+                if self._dirty:
+                    await self.flush()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Flusher error: {e}")
     
     async def add_chat_id(self, chat_id: str) -> bool:
         if chat_id not in self.chat_ids:
             self.chat_ids.add(chat_id)
-            return await self.save_chat_ids()
+            self.save_chat_ids()
+            return True
         return False
     
     async def toggle_subscription(self, user_id: int, subscribe: bool) -> bool:
@@ -151,72 +223,148 @@ class DataStorage:
             self.subscribers.discard(user_id)
             changed = True
         if changed:
-            return await self.save_subscribers()
-        return False
+            self._status_cache_text = None
+            self.save_subscribers()
+        return changed
 
 
 class MessageManager:
     def __init__(self, filename=MESSAGES_FILE):
         self.messages = {}
+        self._flat: Dict[tuple, str] = {}
         self._load(filename)
     
     def _load(self, filename):
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                self.messages = json.load(f)
+            self.messages = self._load_cached(filename)
             logger.info("Сообщения загружены")
         except Exception as e:
             logger.error(f"Ошибка сообщений: {e}")
+        self._flat = {}
+        self._flatten((), self.messages)
+    
+    @staticmethod
+    def _load_cached(filename):
+        """✅ Разобранный messages.json кэшируется в .pkl по (mtime, size) исходника"""
+        stat = os.stat(filename)
+        key = (stat.st_mtime_ns, stat.st_size)
+        cache = Path(f"{filename}.pkl")
+        try:
+            with open(cache, 'rb') as f:
+                cached_key, messages = pickle.load(f)
+            if cached_key == key:
+                return messages
+        except Exception:
+            pass
+        
+        with open(filename, 'rb') as f:
+            messages = orjson.loads(f.read())
+        
+        # ✅ write-sync-rename, чтобы упавший процесс не оставил битый кэш
+        try:
+            temp = cache.with_suffix('.tmp')
+            with open(temp, 'wb') as f:
+                pickle.dump((key, messages), f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            temp.replace(cache)
+        except Exception as e:
+            logger.warning(f"Кэш сообщений не сохранён: {e}")
+        return messages
+    
+    def _flatten(self, prefix, node):
+        """✅ Разворачивает вложенный словарь в {путь: строка} для O(1) доступа"""
+        if prefix and node:
+            self._flat[prefix] = str(node)
+        if isinstance(node, dict):
+            for key, value in node.items():
+                self._flatten(prefix + (key,), value)
     
     def get(self, *path, default=""):
-        result = self.messages
-        for key in path:
-            if isinstance(result, dict):
-                result = result.get(key, default)
-            else:
-                return default
-        return str(result) if result else default
+        return self._flat.get(path, default)
 
 
 class TelegramAPI:
-    def __init__(self, token):
+    JSON_HEADERS = {"Content-Type": "application/json"}
+    
+    def __init__(self, token, session, base_url="https://api.telegram.org"):
         self.token = token
-        self.session = None
-        self.last_request = 0
+        self.url = f"{base_url.rstrip('/')}/bot{token}"
+        self.session = session  # ✅ Общая сессия на всё время работы (keep-alive)
+        self.limiter = AsyncLimiter(TG_RATE_LIMIT, 1)
     
-    async def _make_request(self, method, data):
-        await asyncio.sleep(max(0, 0.3 - (time.time() - self.last_request)))  # ✅ Увеличен delay
-        self.last_request = time.time()
-        
+    async def _make_request(self, method, data, timeout=None):
         try:
-            if self.session is None:
-                connector = aiohttp.TCPConnector(limit=10)
-                self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=15))
-            
-            url = f"https://api.telegram.org/bot{self.token}/{method}"
-            async with self.session.post(url, json=data) as resp:
+            url = f"{self.url}/{method}"
+            resp = await self.session.post(
+                url, data=orjson.dumps(data), headers=self.JSON_HEADERS,
+                timeout=timeout or self.session.timeout
+            )
+            try:
                 if resp.status == 200:
-                    return await resp.json()
+                    return await resp.json(loads=orjson.loads)
+            finally:
+                resp.release()  # ✅ Соединение сразу возвращается в пул
         except:
             pass
         return None
     
-    async def send_message(self, chat_id, text):
+    async def send_message(self, chat_id, text, parse_mode=None):
         if not text or len(text) > 4096:
             return False
-        data = {"chat_id": chat_id, "text": text, "disable_web_page_preview": True, "parse_mode": "Markdown"}
-        result = await self._make_request("sendMessage", data)
+        data = {"chat_id": chat_id, "text": text, "disable_web_page_preview": True}
+        if parse_mode:
+            data["parse_mode"] = parse_mode  # ✅ Только по запросу: иначе '_' в никах ломает отправку
+        # ✅ Лимит 30/сек касается только исходящих сообщений - getUpdates в очередь не встаёт
+        async with self.limiter:
+            result = await self._make_request("sendMessage", data)
         return bool(result and result.get('ok'))
     
     async def get_updates(self, offset=0):
-        data = {"offset": offset, "timeout": 30, "allowed_updates": ["message"]}
-        result = await self._make_request("getUpdates", data)
+        # ✅ Long poll 50 сек: запрос сам ждёт апдейты, отдельная пауза не нужна
+        data = {"offset": offset, "timeout": 50, "allowed_updates": ["message"]}
+        # ✅ Таймаут HTTP должен быть больше long poll, иначе запрос обрывается по total=15
+        result = await self._make_request("getUpdates", data, timeout=aiohttp.ClientTimeout(total=60))
         return result
 
 
+class TelegramMTProtoSender:
+    """Рассылка через MTProto (Telethon): одно постоянное соединение с DC Telegram"""
+    
+    def __init__(self, token, api_id, api_hash, limiter, session_string="", session_file="mtproto_bot"):
+        self.token = token
+        # ✅ Без строки сессии пишем её в файл (<session_file>.session): перезапуск не логинится заново,
+        # а повторный auth.importBotAuthorization Telegram ограничивает
+        session = StringSession(session_string) if session_string else session_file
+        self.client = TelegramClient(session, int(api_id), api_hash)
+        self.limiter = limiter  # ✅ Общий с TelegramAPI: лимит на бота один для обоих транспортов
+    
+    async def start(self):
+        await self.client.start(bot_token=self.token)
+    
+    async def close(self):
+        if self.client.is_connected():
+            await self.client.disconnect()
+    
+    async def send_message(self, chat_id, text, parse_mode=None):
+        if not text or len(text) > 4096:
+            return False
+        try:
+            async with self.limiter:
+                await self.client.send_message(
+                    int(chat_id), text, link_preview=False,
+                    parse_mode=parse_mode.lower() if parse_mode else None
+                )
+            return True
+        except Exception as e:
+            logger.warning(f"MTProto отправка в {chat_id}: {type(e).__name__}: {e}")
+            return False
+
+
 class TelegramNotifier:
-    def __init__(self, api, storage, messages):
+    def __init__(self, api, storage, messages, sender=None):
         self.api = api
+        self.sender = sender or api  # ✅ Канал рассылки; входящие команды всегда через Bot API
         self.storage = storage
         self.messages = messages
         self.bot = None  # ✅ Ссылка на Discord бота
@@ -224,40 +372,54 @@ class TelegramNotifier:
     async def handle_start(self, chat_id):
         added = await self.storage.add_chat_id(chat_id)
         msg = self.messages.get("telegram", "commands", "start", "welcome" if added else "already_registered")
-        return await self.api.send_message(chat_id, MessageFormatter.format_for_telegram(msg))
+        return await self.api.send_message(chat_id, msg)
     
     async def handle_status(self, chat_id):
         """✅ Полный статус из messages.json"""
         await self.api.send_message(chat_id, self.messages.get("telegram", "commands", "status", "loading"))
         
-        subscribers_list = []
-        if self.bot:
-            for user_id in self.storage.subscribers:
-                user = self.bot.get_user(user_id)
-                if user:
-                    display_name = user.display_name or user.name
-                    subscribers_list.append(f"• **{display_name}** (`{user_id}`)")
-                else:
-                    subscribers_list.append(f"• `ID {user_id}`")
-        
-        subs_count = len(subscribers_list)
-        if not subscribers_list:
-            subs_text = self.messages.get("telegram", "errors", "no_subscribers")
-        else:
-            subs_text = "\n".join(subscribers_list[:20])
-            if subs_count > 20:
-                subs_text += f"\n... и ещё `{subs_count-20}`"
+        subs_count = len(self.storage.subscribers) if self.bot else 0
+        subs_text = self.storage._status_cache_text
+        if subs_text is None:
+            subs_text, resolved = self._build_subscribers_text()
+            if resolved:
+                self.storage._status_cache_text = subs_text  # ✅ Кэш до следующего изменения подписок
         
         uptime = str(timedelta(seconds=int(time.time() - self.storage.bot_start_time)))
         
-        status_msg = self.messages.get("telegram", "commands", "status", "title").format(
+        status_msg = MessageFormatter.format_for_telegram(
+            self.messages.get("telegram", "commands", "status", "title"),
             uptime=uptime,
             subs_count=subs_count,
             chats_count=len(self.storage.chat_ids),
             subscribers_list=subs_text
         )
         
-        return await self.api.send_message(chat_id, MessageFormatter.format_for_telegram(status_msg))
+        return await self.api.send_message(chat_id, status_msg, parse_mode="Markdown")
+    
+    def _build_subscribers_text(self):
+        """Список подписчиков для /status; resolved=False, если кого-то нет в кэше Discord"""
+        subscribers = tuple(self.storage.subscribers) if self.bot else ()
+        if not subscribers:
+            return self.messages.get("telegram", "errors", "no_subscribers"), bool(self.bot)
+        
+        resolved = True
+        subscribers_list = []
+        for user_id in subscribers[:20]:
+            user = self.bot.get_user(user_id)
+            if user:
+                display_name = user.display_name or user.name
+                for ch in "_*`[":  # ✅ /status идёт с Markdown - экранируем спецсимволы ника
+                    display_name = display_name.replace(ch, "\\" + ch)
+                subscribers_list.append(f"• **{display_name}** (`{user_id}`)")
+            else:
+                subscribers_list.append(f"• `ID {user_id}`")
+                resolved = False
+        
+        subs_text = "\n".join(subscribers_list)
+        if len(subscribers) > 20:
+            subs_text += f"\n... и ещё `{len(subscribers)-20}`"
+        return subs_text, resolved
     
     async def process_update(self, update):
         try:
@@ -269,12 +431,12 @@ class TelegramNotifier:
                 return await self.handle_start(chat_id)
             elif text == '/help':
                 msg_text = self.messages.get("telegram", "commands", "help", "title")
-                return await self.api.send_message(chat_id, MessageFormatter.format_for_telegram(msg_text))
+                return await self.api.send_message(chat_id, msg_text, parse_mode="Markdown")
             elif text == '/status':
                 return await self.handle_status(chat_id)
             else:
                 error = self.messages.get("telegram", "errors", "invalid_command")
-                return await self.api.send_message(chat_id, MessageFormatter.format_for_telegram(error))
+                return await self.api.send_message(chat_id, error, parse_mode="Markdown")
         except Exception as e:
             logger.error(f"TG обработка: {e}")
             return False
@@ -284,16 +446,20 @@ class TelegramNotifier:
             logger.warning(f"Пропуск рассылки: чатов={len(self.storage.chat_ids)}, текст='{text[:50]}'")
             return 0
         
-        text = MessageFormatter.format_for_telegram(text)
+        chat_ids = tuple(self.storage.chat_ids)  # ✅ Снимок: /start во время рассылки не ломает итерацию
+        # ✅ Параллельная отправка, темп ограничивает limiter в TelegramAPI
+        results = await asyncio.gather(
+            *(self.sender.send_message(chat_id, text) for chat_id in chat_ids),
+            return_exceptions=True
+        )
         sent = 0
-        for i, chat_id in enumerate(self.storage.chat_ids):
-            logger.info(f"Отправка в чат #{i+1}: {chat_id}")
-            if await self.api.send_message(chat_id, text):
+        for chat_id, result in zip(chat_ids, results):
+            if result is True:
                 sent += 1
             else:
                 logger.error(f"❌ ОШИБКА отправки в {chat_id}")
         
-        logger.info(f"Рассылка: {sent}/{len(self.storage.chat_ids)}")
+        logger.info(f"Рассылка: {sent}/{len(chat_ids)}")
         return sent
 
 
@@ -309,9 +475,13 @@ class DiscordBot(commands.Bot):
         self.messages = messages
         self.telegram = telegram
         self.start_time = time.time()
+        # ✅ Шаблоны голосовых событий читаем один раз, а не на каждое событие
+        self._tpl = {k: messages.get("telegram", "voice_events", k) for k in ("joined", "left", "moved")}
     
     async def setup_hook(self):
-        self.add_view(SubscribeView(self))
+        # ✅ Один persistent view на весь процесс, переиспользуется в /notifier
+        self._sub_view = SubscribeView(self)
+        self.add_view(self._sub_view)
     
     async def on_ready(self):
         logger.info(f'Discord бот {self.user} подключился!')
@@ -320,42 +490,21 @@ class DiscordBot(commands.Bot):
         if member.id not in self.storage.subscribers or before.channel == after.channel:
             return
         
-        timestamp = datetime.now()
+        user_name = member.display_name or member.name
         
         try:
-            if after.channel and before.channel is None:
-                # 🟢 ПЕРВЫЙ ВХОД
-                template = self.messages.get("telegram", "voice_events", "joined")
-                msg = template.format(
-                    user_name=member.display_name or member.name,
-                    channel_name=after.channel.name,
-                    user_id=member.id,
-                    time=timestamp.strftime("%H:%M")
-                )
-                await self.telegram.broadcast(msg)
-                
-            elif before.channel and after.channel is None:
-                # 🔴 ВЫХОД
-                template = self.messages.get("telegram", "voice_events", "left")
-                msg = template.format(
-                    user_name=member.display_name or member.name,
-                    channel_name=before.channel.name,
-                    user_id=member.id,
-                    time=timestamp.strftime("%H:%M")
-                )
-                await self.telegram.broadcast(msg)
-                
-            elif before.channel and after.channel and before.channel != after.channel:
-                # 🔄 ПЕРЕМЕЩЕНИЕ
-                template = self.messages.get("telegram", "voice_events", "moved")
-                msg = template.format(
-                    user_name=member.display_name or member.name,
-                    channel_name=after.channel.name,
-                    user_id=member.id,
-                    time=timestamp.strftime("%H:%M")
-                )
-                await self.telegram.broadcast(msg)
-                
+            event_key = next((name for name, match in VOICE_EVENTS if match(before.channel, after.channel)), None)
+            if event_key is None:
+                return
+            channel = after.channel or before.channel
+            msg = MessageFormatter.format_safe(
+                self._tpl[event_key],
+                user_name=user_name,
+                channel_name=channel.name,
+                user_id=member.id,
+                time=_clock_hm
+            )
+            await self.telegram.broadcast(msg)
         except Exception as e:
             logger.error(f"Voice error: {e}")
 
@@ -516,22 +665,27 @@ class SubscribeView(View):
             logger.info(f"👤 {user.name} повторная попытка ({'🔔' if subscribe else '🔕'})")
             return
         
-        # Изменяем подписку
-        success = await self.bot.storage.toggle_subscription(user.id, subscribe)
+        # Изменяем подписку (только в памяти, на диск пишет flusher)
+        await self.bot.storage.toggle_subscription(user.id, subscribe)
         
         # Discord ответ
         msg = self.bot.messages.get("discord", "subscription", action_name)
-        await interaction.followup.send(MessageFormatter.format_for_discord(msg), ephemeral=True)
         
         # Telegram уведомление
         template = self.bot.messages.get("telegram", "subscription", action_name, "content")
-        text = template.format(
+        text = MessageFormatter.format_safe(
+            template,
             user_name=user.display_name or user.name,
             user_id=user.id,
             timestamp=timestamp,
             total_subs=len(self.bot.storage.subscribers)
         )
-        await self.bot.telegram.broadcast(text)
+        
+        # ✅ Ответ в Discord и рассылка в TG независимы - отправляем параллельно
+        await asyncio.gather(
+            interaction.followup.send(MessageFormatter.format_for_discord(msg), ephemeral=True),
+            self.bot.telegram.broadcast(text)
+        )
         
         logger.info(f"👤 {user.name} ({'🔔' if subscribe else '🔕'}) - {len(self.bot.storage.subscribers)} всего")
 
@@ -553,25 +707,55 @@ async def setup_commands(bot):
         telegram_info = bot.messages.get("discord", "notifier", "telegram_info")
         embed.add_field(name="📱 Telegram", value=telegram_info, inline=False)
         
-        await ctx.send(embed=embed, view=SubscribeView(bot))
+        await ctx.send(embed=embed, view=bot._sub_view)
+
 
+async def telegram_update_worker(notifier, queue):
+    """Обработчик апдейтов из очереди"""
+    while True:
+        update = await queue.get()
+        try:
+            await notifier.process_update(update)
+        except Exception as e:
+            logger.error(f"Worker error: {e}")
+        finally:
+            queue.task_done()
 
-async def telegram_polling(notifier):
-    """Telegram long polling"""
+async def telegram_polling(notifier, workers=4):
+    """Telegram long polling: получение апдейтов отделено от их обработки"""
     offset = 0
+    queue = asyncio.Queue(maxsize=500)
+    worker_tasks = [asyncio.create_task(telegram_update_worker(notifier, queue)) for _ in range(workers)]
+    try:
+        while True:
+            try:
+                updates = await notifier.api.get_updates(offset)
+                if updates and updates.get('ok'):
+                    for update in updates.get('result', []):
+                        offset = max(offset, update['update_id'] + 1)
+                        await queue.put(update)
+                else:
+                    await asyncio.sleep(1)  # ✅ Пауза при ошибке запроса, чтобы не долбить API
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Polling error: {e}")
+                await asyncio.sleep(1)
+    finally:
+        for task in worker_tasks:
+            task.cancel()
+        # ✅ Дожидаемся воркеров, пока сессия и Discord клиент ещё не закрыты
+        await asyncio.gather(*worker_tasks, return_exceptions=True)
+
+async def _tick():
+    """Раз в секунду обновляет _clock_hm, чтобы не вызывать strftime на каждое событие"""
+    global _clock_hm
     while True:
         try:
-            updates = await notifier.api.get_updates(offset)
-            if updates and updates.get('ok'):
-                for update in updates.get('result', []):
-                    offset = max(offset, update['update_id'] + 1)
-                    await notifier.process_update(update)
-            await asyncio.sleep(0.1)
+            _clock_hm = time.strftime("%H:%M")
+            await asyncio.sleep(1)
         except asyncio.CancelledError:
             break
-        except Exception as e:
-            logger.error(f"Polling error: {e}")
-            await asyncio.sleep(1)
 
 async def keep_alive_task():
     """Keep-Alive для Render"""
@@ -589,15 +773,34 @@ async def keep_alive_task():
 
 async def main():
     config = validate_tokens()
-    global storage, notifier_obj, api_obj  # ✅ Все глобальные переменные
+    global storage, notifier_obj  # ✅ Все глобальные переменные
     
     # ✅ Создание объектов в правильном порядке
     storage = DataStorage()
     messages = MessageManager()
     
-    api = TelegramAPI(config.telegram_token)
-    api_obj = api  # ✅ Глобальная ссылка для закрытия
-    notifier = TelegramNotifier(api, storage, messages)
+    # ✅ Одна HTTP-сессия на весь процесс: переиспользуем TCP/TLS соединения.
+    # limit_per_host = лимиту отправки: за секунду рассылки каждый запрос получает своё keep-alive соединение
+    session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=100, limit_per_host=TG_RATE_LIMIT, ttl_dns_cache=300, keepalive_timeout=75),
+        timeout=aiohttp.ClientTimeout(total=15)
+    )
+    api = TelegramAPI(config.telegram_token, session, TG_API_BASE_URL)
+    
+    # ✅ MTProto рассылка, если заданы TG_API_ID/TG_API_HASH и установлен telethon
+    sender = None
+    if TG_API_ID and TG_API_HASH:
+        if TelegramClient is None:
+            logger.warning("telethon не установлен - рассылка через Bot API")
+        else:
+            try:
+                sender = TelegramMTProtoSender(
+                    config.telegram_token, int(TG_API_ID), TG_API_HASH, api.limiter, TG_SESSION, TG_SESSION_FILE
+                )
+            except Exception as e:  # ✅ Кривой TG_API_ID/TG_SESSION не должен ронять запуск
+                logger.error(f"MTProto не настроен, рассылка через Bot API: {e}")
+    
+    notifier = TelegramNotifier(api, storage, messages, sender)
     notifier_obj = notifier  # ✅ Глобальная ссылка для keep-alive
     bot = DiscordBot(config, storage, messages, notifier)
     notifier.bot = bot
@@ -607,6 +810,14 @@ async def main():
     await setup_commands(bot)
     
     try:
+        if sender:
+            try:
+                await sender.start()
+                logger.info("✅ MTProto рассылка подключена")
+            except Exception as e:
+                logger.error(f"MTProto недоступен, рассылка через Bot API: {e}")
+                notifier.sender = api
+        
         # ✅ Startup уведомление
         startup_msg = messages.get("telegram", "system", "bot_started")
         await notifier.broadcast(MessageFormatter.format_for_telegram(
@@ -619,10 +830,12 @@ async def main():
         bot_task = asyncio.create_task(bot.start(config.discord_token))
         polling_task = asyncio.create_task(telegram_polling(notifier))
         keep_alive_task_ = asyncio.create_task(keep_alive_task())
+        flusher_task = asyncio.create_task(storage._flusher())
+        clock_task = asyncio.create_task(_tick())
         
         # ✅ Ждем завершения любой задачи
         done, pending = await asyncio.wait(
-            [bot_task, polling_task, keep_alive_task_], 
+            [bot_task, polling_task, keep_alive_task_, flusher_task, clock_task], 
             return_when=asyncio.FIRST_COMPLETED
         )
         
@@ -646,14 +859,26 @@ async def main():
         try:
             if notifier_obj:
                 shutdown_msg = messages.get("telegram", "system", "bot_stopped")
-                await notifier_obj.broadcast(MessageFormatter.format_for_telegram(shutdown_msg))
+                await notifier_obj.broadcast(shutdown_msg)
         except Exception as e:
             logger.error(f"Shutdown уведомление ошибка: {e}")
         
+        # ✅ Финальный сброс данных на диск
+        try:
+            await storage.flush()
+        except Exception as e:
+            logger.error(f"Финальное сохранение данных: {e}")
+        
         # ✅ Закрытие сессий
         try:
-            if api_obj and api_obj.session and not api_obj.session.closed:
-                await api_obj.session.close()
+            if sender:
+                await sender.close()
+        except Exception as e:
+            logger.error(f"Закрытие MTProto клиента: {e}")
+        
+        try:
+            if not session.closed:
+                await session.close()
                 logger.info("✅ Telegram сессия закрыта")
         except Exception as e:
             logger.error(f"Закрытие Telegram сессии: {e}")